@@ -0,0 +1,28 @@
+"""
+Optional build step for the AI service.
+
+Compiles the hot string-processing paths to a C extension with mypyc. The
+build is opt-in; without it the pure-Python module is imported as usual:
+
+    cd ai-service/src && AI_SERVICE_MYPYC=1 python ../setup.py build_ext --inplace
+"""
+
+import os
+
+from setuptools import setup
+
+ext_modules = []
+if os.getenv("AI_SERVICE_MYPYC") == "1":
+    from mypyc.build import mypycify
+    ext_modules = mypycify([
+        "--ignore-missing-imports",
+        # Name the module from src/ so it imports as plain `text_processing`
+        "--explicit-package-bases",
+        "text_processing.py",
+    ])
+
+setup(
+    name="ai-service",
+    version="1.0.0",
+    ext_modules=ext_modules,
+)
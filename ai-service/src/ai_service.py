@@ -5,10 +5,15 @@ This module combines RAG (Retrieval-Augmented Generation) with LLM for
 intelligent test generation and analysis.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, List, Optional, Tuple
+from functools import lru_cache
 from pathlib import Path
+import asyncio
+import hashlib
+import importlib.util
 import json
 import os
+import re
 import sys
 
 # Add the current directory to the path for imports
@@ -16,16 +21,41 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-# Import with error handling
-try:
-    from rag.code_indexer import CodeIndexer
-    from llm.ollama_service import OllamaService
-    IMPORTS_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: Some imports failed: {e}")
-    IMPORTS_AVAILABLE = False
-    CodeIndexer = None
-    OllamaService = None
+# numpy and text_processing (which needs numpy) are imported where they are used,
+# so importing this module for /health and server startup stays cheap
+if TYPE_CHECKING:
+    import numpy as np
+    from rag.search_batch import SearchBatch
+
+# Hard dependencies of the indexer and LLM client. They are only checked here;
+# the heavy imports are deferred to AIService.__init__ to keep startup fast.
+_REQUIRED_MODULES = ("chromadb", "tree_sitter", "httpx", "msgspec")
+_MISSING_MODULES = [name for name in _REQUIRED_MODULES if importlib.util.find_spec(name) is None]
+IMPORTS_AVAILABLE = not _MISSING_MODULES
+if _MISSING_MODULES:
+    print(f"Warning: Some imports failed: missing {', '.join(_MISSING_MODULES)}")
+
+# Candidates fetched per context chunk before MMR reranking
+_MMR_FETCH_FACTOR = 3
+
+# Characters stripped from test names; \w keeps the Unicode letters isalnum allowed
+_SAFE = re.compile(r'[^\w \-]+')
+
+# Bytes of a source file sent to the LLM, about an 8K-token context window
+MAX_CTX_BYTES = 32 * 1024
+
+
+@lru_cache(maxsize=256)
+def _read_cached(path: str, mtime_ns: int, size: int, max_bytes: int) -> Tuple[str, bool]:
+    """Read up to max_bytes of a source file; mtime and size only key the cache."""
+    with open(path, "rb") as f:
+        data = f.read(max_bytes)
+    return data.decode("utf-8", errors="replace"), size > max_bytes
+
+
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a payload as a server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 class AIService:
@@ -35,28 +65,73 @@ class AIService:
                  codebase_path: str,
                  db_path: str = "./chroma_db",
                  ollama_url: str = "http://localhost:11434",
-                 ollama_model: str = "mistral"):
+                 ollama_model: str = "mistral:7b-instruct-q4_K_M",
+                 ollama_keep_alive: str = "30m",
+                 cache_threshold: float = 0.85,
+                 cache_ttl: float = 300.0,
+                 batch_size: Optional[int] = None,
+                 mmr_lambda: float = 0.5,
+                 max_ctx_bytes: int = MAX_CTX_BYTES):
         
         if not IMPORTS_AVAILABLE:
             raise ImportError("Required modules not available. Check dependencies.")
         
         self.codebase_path = Path(codebase_path)
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.mmr_lambda = mmr_lambda
+        # Upper bound on formatted context size, which also caps prompt-eval cost
+        self.max_context_chars = 24000
+        self.max_ctx_bytes = max_ctx_bytes
         
         # Initialize components
         try:
+            from rag.code_indexer import CodeIndexer
+            from llm.ollama_service import OllamaService
+            from cache.semantic_cache import SemanticCache
+            from cache.exact_cache import ExactCache
+            
             self.indexer = CodeIndexer(db_path)
-            self.llm = OllamaService(ollama_url, ollama_model)
+            self.llm = OllamaService(ollama_url, ollama_model, ollama_keep_alive)
+            self._sem_cache = SemanticCache(
+                dim=self.indexer.embedding_dim,
+                threshold=cache_threshold,
+                ttl=cache_ttl,
+                persist_path=os.path.join(db_path, "semcache.db")
+            )
+            # Checked before the semantic cache so exact repeats skip embedding
+            self._exact_cache = ExactCache(maxsize=512, ttl=cache_ttl)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize AI service components: {e}")
         
         # Service status
         self._indexed = False
     
-    def setup(self) -> Dict[str, Any]:
+    async def aclose(self):
+        """Release network resources held by the LLM client."""
+        await self.llm.aclose()
+    
+    def evict_expired_cache(self):
+        """Drop expired semantic cache entries, in memory and on disk."""
+        self._sem_cache.evict_expired()
+    
+    def _exact_cache_key(self, requirements: str, context_query: Optional[str]) -> str:
+        """Key an exact-match cache entry by model, codebase and request text."""
+        return self._exact_cache.key(self.llm.model, str(self.codebase_path), requirements, context_query)
+    
+    def _cache_namespace(self, name: str) -> str:
+        """Scope a cache namespace to the current codebase, the LLM and the embedding model."""
+        return f"{self.codebase_path}|{self.llm.model}|{self.indexer.embedding_model}|{name}"
+    
+    def _semantic_lookup(self, text: str, namespace: str) -> Tuple[List[float], Optional[Dict[str, Any]]]:
+        """Embed a request and look it up in the semantic cache; blocking, run off the event loop."""
+        cache_vec = self.indexer.embed_query(text)
+        return cache_vec, self._sem_cache.lookup(cache_vec, namespace=namespace)
+    
+    async def setup(self) -> Dict[str, Any]:
         """Setup the AI service (index codebase, check LLM)."""
         results = {
-            "llm_status": self.llm.health_check(),
+            "llm_status": await self.llm.health_check(),
             "indexing_status": None,
             "overall_status": "unknown"
         }
@@ -66,9 +141,17 @@ class AIService:
             results["overall_status"] = "llm_unavailable"
             return results
         
+        # Responses generated against the previous index are stale once it is rebuilt,
+        # in both tiers and for every model used on this codebase
+        self._exact_cache.clear()
+        await asyncio.to_thread(self._sem_cache.clear, f"{self.codebase_path}|")
+        
         # Index codebase
         try:
-            indexing_result = self.indexer.index_codebase(str(self.codebase_path))
+            indexing_result = await self.indexer.aindex_codebase(
+                str(self.codebase_path),
+                batch_size=self.batch_size
+            )
             results["indexing_status"] = indexing_result
             self._indexed = True
             results["overall_status"] = "ready"
@@ -78,7 +161,10 @@ class AIService:
         
         return results
     
-    def generate_test(self, requirements: str, context_query: Optional[str] = None) -> Dict[str, Any]:
+    async def generate_test(self,
+                            requirements: str,
+                            context_query: Optional[str] = None,
+                            use_cache: bool = True) -> Dict[str, Any]:
         """Generate a test based on requirements and codebase context."""
         if not self._indexed:
             return {
@@ -86,25 +172,109 @@ class AIService:
                 "error": "Codebase not indexed. Run setup() first."
             }
         
-        # Get relevant context from codebase
-        if context_query:
-            search_query = context_query
-        else:
-            search_query = requirements
+        # Serve exact repeats, then near-duplicate requests, from cache
+        cache_key = None
+        cache_vec = None
+        if use_cache:
+            cache_key = self._exact_cache_key(requirements, context_query)
+            cached = self._exact_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            cache_vec, cached = await asyncio.to_thread(
+                self._semantic_lookup,
+                f"{requirements}|{context_query or ''}",
+                self._cache_namespace("generate")
+            )
+            if cached is not None:
+                return cached
         
-        context_chunks = self.indexer.search(search_query, n_results=5)
-        context_text = self._format_context(context_chunks)
+        # Get relevant context from codebase
+        search_query, context_batch, context_text = await asyncio.to_thread(
+            self._retrieve_context, requirements, context_query
+        )
         
         # Generate test using LLM
-        result = self.llm.generate_test(context_text, requirements)
+        result = await self.llm.generate_test(context_text, requirements)
         
         if result["success"]:
-            result["context_used"] = context_chunks
+            result["context_used"] = context_batch.to_dicts()
             result["context_query"] = search_query
+            result["cache_hit"] = False
+            if cache_vec is not None:
+                self._exact_cache.put(cache_key, result)
+                await asyncio.to_thread(
+                    self._sem_cache.add, cache_vec, result, namespace=self._cache_namespace("generate")
+                )
         
         return result
     
-    def modify_test(self, file_path: str, modification_request: str) -> Dict[str, Any]:
+    async def generate_test_stream(self,
+                                   requirements: str,
+                                   context_query: Optional[str] = None,
+                                   use_cache: bool = True) -> AsyncIterator[str]:
+        """Generate a test, streaming tokens as server-sent events."""
+        if not self._indexed:
+            yield _format_sse("error", {
+                "success": False,
+                "error": "Codebase not indexed. Run setup() first."
+            })
+            return
+        
+        cache_key = None
+        cache_vec = None
+        if use_cache:
+            cache_key = self._exact_cache_key(requirements, context_query)
+            cached = self._exact_cache.get(cache_key)
+            if cached is None:
+                cache_vec, cached = await asyncio.to_thread(
+                    self._semantic_lookup,
+                    f"{requirements}|{context_query or ''}",
+                    self._cache_namespace("generate")
+                )
+            if cached is not None:
+                yield _format_sse("token", {"token": cached["content"]})
+                cached["validation"] = self.validate_generated_code(cached["content"])
+                yield _format_sse("done", cached)
+                return
+        
+        search_query, context_batch, context_text = await asyncio.to_thread(
+            self._retrieve_context, requirements, context_query
+        )
+        
+        parts = []
+        try:
+            async for token in self.llm.generate_test_stream(context_text, requirements):
+                parts.append(token)
+                yield _format_sse("token", {"token": token})
+        except Exception as e:
+            yield _format_sse("error", {
+                "success": False,
+                "error": f"Streaming generation failed: {str(e)}"
+            })
+            return
+        
+        # Validate the accumulated buffer once the stream has closed
+        result = {
+            "success": True,
+            "content": "".join(parts),
+            "context_used": context_batch.to_dicts(),
+            "context_query": search_query,
+            "cache_hit": False
+        }
+        if cache_vec is not None:
+            self._exact_cache.put(cache_key, result)
+            await asyncio.to_thread(
+                self._sem_cache.add, cache_vec, result, namespace=self._cache_namespace("generate")
+            )
+        
+        result["validation"] = self.validate_generated_code(result["content"])
+        yield _format_sse("done", result)
+    
+    async def modify_test(self,
+                          file_path: str,
+                          modification_request: str,
+                          use_cache: bool = True) -> Dict[str, Any]:
         """Modify an existing test file."""
         if not self._indexed:
             return {
@@ -114,46 +284,75 @@ class AIService:
         
         # Read the original file
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                original_code = f.read()
+            original_code, truncated = self._read_source(file_path)
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Failed to read file {file_path}: {str(e)}"
             }
         
+        # Cached modifications are only valid for the exact same file contents
+        content_hash = hashlib.blake2b(original_code.encode('utf-8'), digest_size=16).hexdigest()
+        cache_namespace = self._cache_namespace(f"modify:{file_path}:{content_hash}")
+        cache_vec = None
+        if use_cache:
+            cache_vec, cached = await asyncio.to_thread(
+                self._semantic_lookup, modification_request, cache_namespace
+            )
+            if cached is not None:
+                return cached
+        
         # Get context about similar tests
-        context_chunks = self.indexer.search(f"test file {file_path}", n_results=3)
-        context_text = self._format_context(context_chunks)
+        context_batch = await asyncio.to_thread(self.indexer.search, f"test file {file_path}", n_results=3)
+        context_text = self._format_context(context_batch)
         
         # Modify the test
-        result = self.llm.modify_test(original_code, modification_request)
+        result = await self.llm.modify_test(original_code, modification_request)
         
         if result["success"]:
             result["original_file"] = file_path
-            result["context_used"] = context_chunks
+            result["truncated"] = truncated
+            result["context_used"] = context_batch.to_dicts()
+            result["cache_hit"] = False
+            if cache_vec is not None:
+                await asyncio.to_thread(self._sem_cache.add, cache_vec, result, namespace=cache_namespace)
         
         return result
     
-    def analyze_test(self, file_path: str) -> Dict[str, Any]:
+    async def analyze_test(self, file_path: str) -> Dict[str, Any]:
         """Analyze a test file and provide suggestions."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                code = f.read()
+            code, truncated = self._read_source(file_path)
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Failed to read file {file_path}: {str(e)}"
             }
         
-        return self.llm.analyze_code(code)
+        result = await self.llm.analyze_code(code)
+        result["truncated"] = truncated
+        return result
     
-    def search_tests(self, query: str, n_results: int = 10) -> List[Dict[str, Any]]:
+    def _read_source(self, file_path: str) -> Tuple[str, bool]:
+        """Read a file capped at max_ctx_bytes, serving unchanged files from memory."""
+        st = os.stat(file_path)
+        code, truncated = _read_cached(
+            os.path.abspath(file_path), st.st_mtime_ns, st.st_size, self.max_ctx_bytes
+        )
+        if truncated:
+            print(f"Warning: {file_path} exceeds {self.max_ctx_bytes} bytes, only the start is used")
+        return code, truncated
+    
+    def search_tests(self,
+                     query: str,
+                     n_results: int = 10,
+                     include_embeddings: bool = False) -> List[Dict[str, Any]]:
         """Search for relevant tests in the codebase."""
         if not self._indexed:
             return []
         
-        return self.indexer.search(query, n_results)
+        batch = self.indexer.search(query, n_results, include_embeddings=include_embeddings)
+        return batch.to_dicts(include_embeddings=include_embeddings)
     
     def get_codebase_stats(self) -> Dict[str, Any]:
         """Get statistics about the indexed codebase."""
@@ -162,56 +361,70 @@ class AIService:
         
         return self.indexer.get_collection_stats()
     
-    def _format_context(self, chunks: List[Dict[str, Any]]) -> str:
-        """Format context chunks for LLM prompt."""
-        if not chunks:
-            return "No relevant context found."
-        
-        context_parts = []
-        for i, chunk in enumerate(chunks, 1):
-            metadata = chunk.get("metadata", {})
-            file_path = metadata.get("file_path", "unknown")
-            node_type = metadata.get("node_type", "unknown")
-            
-            context_parts.append(f"""
---- Context {i} (from {file_path}, type: {node_type}) ---
-{chunk["content"]}
-""")
+    def _retrieve_context(self,
+                          requirements: str,
+                          context_query: Optional[str]) -> Tuple[str, "SearchBatch", str]:
+        """Search the index and format the context for a generation request."""
+        search_query = context_query or requirements
         
-        return "\n".join(context_parts)
-    
-    def validate_generated_code(self, code: str) -> Dict[str, Any]:
-        """Basic validation of generated code."""
-        validation_result = {
-            "valid": True,
-            "issues": [],
-            "warnings": []
-        }
+        # Over-fetch candidates, then keep a relevant but non-redundant subset
+        query_vec = self.indexer.embed_query(search_query)
+        candidates = self.indexer.search(
+            search_query,
+            n_results=5 * _MMR_FETCH_FACTOR,
+            include_embeddings=True,
+            query_embedding=query_vec
+        )
         
-        # Check for basic TypeScript/Playwright patterns
-        if "import" not in code and "require" not in code:
-            validation_result["warnings"].append("No imports found - may need Playwright imports")
+        selected = self._mmr_rerank(query_vec, candidates.embeddings, k=5, lambda_=self.mmr_lambda)
+        context_batch = candidates.take(selected)
         
-        if "test(" not in code and "it(" not in code:
-            validation_result["issues"].append("No test function found")
-            validation_result["valid"] = False
+        return search_query, context_batch, self._format_context(context_batch)
+    
+    def _mmr_rerank(self,
+                    query_vec: List[float],
+                    cand_vecs: "np.ndarray",
+                    k: int,
+                    lambda_: float = 0.5) -> List[int]:
+        """Select k candidate indices by Maximal Marginal Relevance."""
+        import numpy as np
         
-        if "expect(" not in code and "assert(" not in code:
-            validation_result["warnings"].append("No assertions found")
+        n = len(cand_vecs)
+        if n == 0 or k <= 0:
+            return []
         
-        if "page." not in code:
-            validation_result["warnings"].append("No page interactions found")
+        # Normalize so that dot products are cosine similarities
+        cand = np.ascontiguousarray(cand_vecs, dtype=np.float32)
+        cand = cand / np.maximum(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_vec, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
         
-        # Check for common syntax issues
-        if code.count("{") != code.count("}"):
-            validation_result["issues"].append("Mismatched braces")
-            validation_result["valid"] = False
+        # All pairwise similarities computed once up front
+        sim_q = cand @ query
+        sim_cc = cand @ cand.T
         
-        if code.count("(") != code.count(")"):
-            validation_result["issues"].append("Mismatched parentheses")
-            validation_result["valid"] = False
+        selected = [int(np.argmax(sim_q))]
+        max_sim = sim_cc[:, selected[0]].copy()
+        for _ in range(min(k, n) - 1):
+            scores = lambda_ * sim_q - (1 - lambda_) * max_sim
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            max_sim = np.maximum(max_sim, sim_cc[:, best])
         
-        return validation_result
+        return selected
+    
+    def _format_context(self, batch: "SearchBatch") -> str:
+        """Format context chunks for LLM prompt."""
+        import text_processing
+        return text_processing.format_context(
+            batch.file_paths, batch.metadatas, batch.contents, self.max_context_chars
+        )
+    
+    def validate_generated_code(self, code: str) -> Dict[str, Any]:
+        """Basic validation of generated code."""
+        import text_processing
+        return text_processing.validate_generated_code(code)
     
     def save_generated_test(self, 
                           code: str, 
@@ -224,14 +437,12 @@ class AIService:
             output_path.mkdir(parents=True, exist_ok=True)
             
             # Generate filename
-            safe_name = "".join(c for c in test_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            safe_name = safe_name.replace(' ', '-').lower()
+            safe_name = _SAFE.sub('', test_name).rstrip().replace(' ', '-').lower()
             filename = f"{safe_name}.spec.ts"
             file_path = output_path / filename
             
             # Write the file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(code)
+            file_path.write_text(code, encoding='utf-8')
             
             return {
                 "success": True,
@@ -4,12 +4,15 @@ FastAPI Server for AI Test Automation Service
 This module provides HTTP endpoints for the AI-powered test automation service.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, List, Optional
+import asyncio
 import os
 import sys
+import threading
 
 # Add the src directory to the path so we can import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -27,7 +30,9 @@ except ImportError as e:
 app = FastAPI(
     title="AI Test Automation Service",
     description="AI-powered test generation and analysis using LLM and RAG",
-    version="1.0.0"
+    version="1.0.0",
+    # Serialize in native code; also handles numpy arrays without .tolist() copies
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -39,39 +44,102 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize AI service only if available
+# AI service is created on first use so startup and /health skip the ML stack
 ai_service = None
-if AI_SERVICE_AVAILABLE:
-    try:
-        # Get the project root (two levels up from src)
-        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        ai_service = AIService(
-            codebase_path=project_root,
-            db_path="./chroma_db",
-            ollama_url="http://localhost:11434",
-            ollama_model="mistral:latest"
-        )
-        print(f"✅ AI Service initialized successfully with codebase path: {project_root}")
-    except Exception as e:
-        print(f"Warning: Failed to initialize AI service: {e}")
-        ai_service = None
-        AI_SERVICE_AVAILABLE = False
+_ai_service_lock = threading.Lock()
+
+def _load_ai_service() -> Optional["AIService"]:
+    """Return the AI service, initializing it on first call if available."""
+    global ai_service, AI_SERVICE_AVAILABLE
+    if ai_service is not None or not AI_SERVICE_AVAILABLE:
+        return ai_service
+    
+    with _ai_service_lock:
+        if ai_service is None and AI_SERVICE_AVAILABLE:
+            try:
+                # Get the project root (two levels up from src)
+                project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                ai_service = AIService(
+                    codebase_path=project_root,
+                    db_path="./chroma_db",
+                    ollama_url="http://localhost:11434",
+                    ollama_model="mistral:7b-instruct-q4_K_M"
+                )
+                print(f"✅ AI Service initialized successfully with codebase path: {project_root}")
+            except Exception as e:
+                print(f"Warning: Failed to initialize AI service: {e}")
+                AI_SERVICE_AVAILABLE = False
+    return ai_service
+
+def get_ai_service() -> Any:
+    """FastAPI dependency that returns the AI service or responds with 503."""
+    service = _load_ai_service()
+    if service is None:
+        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
+    return service
+
+async def _start_ai_service():
+    """Initialize the AI service off the event loop, then preload the Ollama model."""
+    service = await asyncio.to_thread(_load_ai_service)
+    if service is not None:
+        await service.llm.warmup()
+
+# Seconds between sweeps of expired semantic cache entries
+CACHE_EVICT_INTERVAL = 60.0
+
+async def _evict_cache_loop():
+    """Periodically drop expired semantic cache entries off the event loop."""
+    while True:
+        await asyncio.sleep(CACHE_EVICT_INTERVAL)
+        if ai_service is None:
+            continue
+        try:
+            await asyncio.to_thread(ai_service.evict_expired_cache)
+        except Exception as e:
+            print(f"Warning: Semantic cache eviction failed: {e}")
+
+def _no_cache(request_flag: bool, header: Optional[str]) -> bool:
+    """True when the body flag or the x-no-cache header opts out of caching."""
+    return request_flag or (header or "").strip().lower() in ("1", "true", "yes")
+
+@app.on_event("startup")
+async def startup_event():
+    """Load the AI service and preload the model in the background so startup is not delayed."""
+    if AI_SERVICE_AVAILABLE:
+        app.state.warmup_task = asyncio.create_task(_start_ai_service())
+        app.state.evict_task = asyncio.create_task(_evict_cache_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the LLM connection pool on shutdown."""
+    if ai_service is not None:
+        await ai_service.aclose()
 
 # Pydantic models for request/response
 class SetupRequest(BaseModel):
     codebase_path: Optional[str] = None
+    ollama_model: Optional[str] = None
+    keep_alive: Optional[str] = None
+    batch_size: Optional[int] = Field(None, ge=1)
 
 class GenerateTestRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
     requirements: str
     context_query: Optional[str] = None
+    no_cache: bool = Field(False, alias="x-no-cache")
 
 class ModifyTestRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
     file_path: str
     modification_request: str
+    no_cache: bool = Field(False, alias="x-no-cache")
 
 class SearchRequest(BaseModel):
     query: str
     n_results: int = 10
+    include_embeddings: bool = False
 
 class SaveTestRequest(BaseModel):
     code: str
@@ -91,47 +159,67 @@ async def health_check():
 
 # Setup endpoint
 @app.post("/setup")
-async def setup_service(request: SetupRequest):
+async def setup_service(request: SetupRequest,
+                        ai_service: Any = Depends(get_ai_service)):
     """Setup the AI service (index codebase, check LLM)."""
-    if not AI_SERVICE_AVAILABLE or ai_service is None:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
         if request.codebase_path:
             ai_service.codebase_path = request.codebase_path
+        if request.batch_size:
+            ai_service.batch_size = request.batch_size
+        if request.ollama_model:
+            ai_service.llm.model = request.ollama_model
+        if request.keep_alive:
+            ai_service.llm.keep_alive = request.keep_alive
         
-        result = ai_service.setup()
+        result = await ai_service.setup()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Generate test endpoint
 @app.post("/generate-test")
-async def generate_test(request: GenerateTestRequest):
+async def generate_test(request: GenerateTestRequest,
+                        x_no_cache: Optional[str] = Header(None),
+                        ai_service: Any = Depends(get_ai_service)):
     """Generate a test based on requirements and codebase context."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
-        result = ai_service.generate_test(
+        result = await ai_service.generate_test(
             requirements=request.requirements,
-            context_query=request.context_query
+            context_query=request.context_query,
+            use_cache=not _no_cache(request.no_cache, x_no_cache)
         )
-        return result
+        # Returned directly so large context payloads skip jsonable_encoder
+        return ORJSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming generate test endpoint
+@app.post("/generate-test/stream")
+async def generate_test_stream(request: GenerateTestRequest,
+                               x_no_cache: Optional[str] = Header(None),
+                               ai_service: Any = Depends(get_ai_service)):
+    """Generate a test, streaming tokens as server-sent events."""
+    return StreamingResponse(
+        ai_service.generate_test_stream(
+            requirements=request.requirements,
+            context_query=request.context_query,
+            use_cache=not _no_cache(request.no_cache, x_no_cache)
+        ),
+        media_type="text/event-stream"
+    )
+
 # Modify test endpoint
 @app.post("/modify-test")
-async def modify_test(request: ModifyTestRequest):
+async def modify_test(request: ModifyTestRequest,
+                      x_no_cache: Optional[str] = Header(None),
+                      ai_service: Any = Depends(get_ai_service)):
     """Modify an existing test file."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
-        result = ai_service.modify_test(
+        result = await ai_service.modify_test(
             file_path=request.file_path,
-            modification_request=request.modification_request
+            modification_request=request.modification_request,
+            use_cache=not _no_cache(request.no_cache, x_no_cache)
         )
         return result
     except Exception as e:
@@ -139,40 +227,36 @@ async def modify_test(request: ModifyTestRequest):
 
 # Analyze test endpoint
 @app.get("/analyze-test/{file_path:path}")
-async def analyze_test(file_path: str):
+async def analyze_test(file_path: str,
+                       ai_service: Any = Depends(get_ai_service)):
     """Analyze a test file and provide suggestions."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
-        result = ai_service.analyze_test(file_path)
+        result = await ai_service.analyze_test(file_path)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Search tests endpoint
 @app.post("/search-tests")
-async def search_tests(request: SearchRequest):
+async def search_tests(request: SearchRequest,
+                       ai_service: Any = Depends(get_ai_service)):
     """Search for relevant tests in the codebase."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
-        results = ai_service.search_tests(
+        # Query embedding and the Chroma query block, so keep them off the event loop
+        results = await asyncio.to_thread(
+            ai_service.search_tests,
             query=request.query,
-            n_results=request.n_results
+            n_results=request.n_results,
+            include_embeddings=request.include_embeddings
         )
-        return {"results": results}
+        return ORJSONResponse({"results": results})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get codebase stats endpoint
 @app.get("/codebase-stats")
-async def get_codebase_stats():
+async def get_codebase_stats(ai_service: Any = Depends(get_ai_service)):
     """Get statistics about the indexed codebase."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
         stats = ai_service.get_codebase_stats()
         return stats
@@ -181,11 +265,9 @@ async def get_codebase_stats():
 
 # Validate code endpoint
 @app.post("/validate-code")
-async def validate_code(code: str):
+async def validate_code(code: str,
+                        ai_service: Any = Depends(get_ai_service)):
     """Validate generated code."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
         result = ai_service.validate_generated_code(code)
         return result
@@ -194,11 +276,9 @@ async def validate_code(code: str):
 
 # Save test endpoint
 @app.post("/save-test")
-async def save_test(request: SaveTestRequest):
+async def save_test(request: SaveTestRequest,
+                    ai_service: Any = Depends(get_ai_service)):
     """Save generated test to file."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
         result = ai_service.save_generated_test(
             code=request.code,
@@ -211,17 +291,30 @@ async def save_test(request: SaveTestRequest):
 
 # LLM health check endpoint
 @app.get("/llm-health")
-async def llm_health_check():
+async def llm_health_check(ai_service: Any = Depends(get_ai_service)):
     """Check LLM service health."""
-    if not AI_SERVICE_AVAILABLE:
-        raise HTTPException(status_code=503, detail="AI Service not available - missing dependencies")
-    
     try:
-        result = ai_service.llm.health_check()
+        result = await ai_service.llm.health_check()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # One worker by default: index readiness and the Chroma client are per process,
+    # so /setup on one worker would leave the others unindexed. Auto-reload is only
+    # for development since it forces a single worker.
+    reload = os.getenv("ENV", "prod") == "dev"
+    workers = 1 if reload else int(os.getenv("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "api_server:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        reload=reload,
+        # uvloop and httptools when installed (uvicorn[standard])
+        loop="auto",
+        http="auto",
+        log_level="info"
+    ) 
\ No newline at end of file
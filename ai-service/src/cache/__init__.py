@@ -0,0 +1,12 @@
+"""
+Cache Module for AI Test Automation
+
+This module provides response caching so that repeated or near-duplicate
+requests can be answered without another LLM generation.
+"""
+
+from .semantic_cache import SemanticCache
+from .persistent_cache import PersistentCache
+from .exact_cache import ExactCache
+
+__all__ = ['SemanticCache', 'PersistentCache', 'ExactCache']
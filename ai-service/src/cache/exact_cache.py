@@ -0,0 +1,69 @@
+"""
+Exact-Match Response Cache
+
+This module caches LLM responses keyed by a hash of the exact request, so
+repeated requests skip embedding as well as generation.
+"""
+
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# Try to import blake3, fallback to hashlib blake2b if not available
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+    print("Warning: blake3 not available, using blake2b for exact cache keys")
+
+
+class ExactCache:
+    """LRU cache of LLM responses keyed by a hash of the request fields."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Each entry is (stored_at, response)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def key(*parts: Optional[str]) -> str:
+        """Hash request fields into a cache key."""
+        # JSON keeps field boundaries, so ("a|", "b") and ("a", "|b") stay distinct
+        data = json.dumps(parts).encode('utf-8')
+        if BLAKE3_AVAILABLE:
+            return blake3.blake3(data).hexdigest()
+        return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached response for a key, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+
+        response = copy.deepcopy(entry[1])
+        response["cache_hit"] = True
+        response["cache_similarity"] = 1.0
+        return response
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """Store a response, evicting the least recently used entry when full."""
+        self._entries[key] = (time.time(), copy.deepcopy(response))
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached entries."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
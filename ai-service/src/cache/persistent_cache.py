@@ -0,0 +1,145 @@
+"""
+Persistent Semantic Cache
+
+This module stores LLM responses in a sqlite-vec virtual table so that cached
+responses survive service restarts.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Try to import sqlite_vec, persistence is disabled if not available
+try:
+    import sqlite_vec
+    SQLITE_VEC_AVAILABLE = True
+except ImportError:
+    SQLITE_VEC_AVAILABLE = False
+    print("Warning: sqlite_vec not available, semantic cache will not persist across restarts")
+
+
+class PersistentCache:
+    """On-disk cache of LLM responses, searched by cosine distance per workspace."""
+
+    def __init__(self,
+                 path: str,
+                 dim: int = 384,
+                 max_distance: float = 0.15,
+                 ttl: float = 300.0):
+        if not SQLITE_VEC_AVAILABLE:
+            raise RuntimeError("sqlite_vec is not installed")
+
+        self.path = path
+        self.dim = dim
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.enable_load_extension(True)
+        sqlite_vec.load(self.conn)
+        self.conn.enable_load_extension(False)
+
+        # WAL + mmap keep lookups off the write path and out of read syscalls
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA mmap_size=268435456")
+
+        # A table created for another embedding size cannot be queried; start it over
+        row = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cache'"
+        ).fetchone()
+        if row is not None and f"float[{dim}]" not in row[0]:
+            print(f"Warning: Persistent semantic cache at {path} has another dimension, recreating it")
+            self.conn.execute("DROP TABLE cache")
+        self.conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS cache USING vec0(
+                workspace TEXT PARTITION KEY,
+                embedding float[{dim}] distance_metric=cosine,
+                expires_at INTEGER,
+                +response TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def lookup(self, embedding: np.ndarray, workspace: str) -> Optional[Tuple[Dict[str, Any], float, float]]:
+        """Return the closest live response, its cosine similarity and remaining TTL, or None."""
+        now = time.time()
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT response, distance, expires_at FROM cache "
+                    "WHERE embedding MATCH ? AND k = 1 AND workspace = ? AND expires_at > ?",
+                    (self._serialize(embedding), workspace, int(now))
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Persistent semantic cache lookup failed: {e}")
+            return None
+
+        if row is None or row[1] >= self.max_distance:
+            return None
+        return json.loads(row[0]), 1.0 - float(row[1]), max(0.0, row[2] - now)
+
+    def add(self,
+            embedding: np.ndarray,
+            response: Dict[str, Any],
+            workspace: str,
+            ttl: Optional[float] = None):
+        """Store a response for a workspace with a per-row expiry."""
+        expires_at = int(time.time() + (self.ttl if ttl is None else ttl))
+        try:
+            with self._lock:
+                self.conn.execute(
+                    "INSERT INTO cache(workspace, embedding, expires_at, response) VALUES (?, ?, ?, ?)",
+                    (workspace, self._serialize(embedding), expires_at, json.dumps(response))
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            # The in-memory tier still holds the entry; losing only the disk copy is fine
+            print(f"Warning: Persistent semantic cache write failed: {e}")
+
+    def evict_expired(self) -> int:
+        """Delete expired rows and return how many were removed."""
+        try:
+            with self._lock:
+                cursor = self.conn.execute(
+                    "DELETE FROM cache WHERE expires_at <= ?", (int(time.time()),)
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: Persistent semantic cache eviction failed: {e}")
+            return 0
+        return cursor.rowcount
+
+    def clear(self, prefix: Optional[str] = None) -> int:
+        """Delete rows whose workspace starts with prefix, or all rows, and return how many."""
+        try:
+            with self._lock:
+                if prefix is None:
+                    cursor = self.conn.execute("DELETE FROM cache")
+                    self.conn.commit()
+                    return cursor.rowcount
+                rowids = [
+                    (rowid,) for rowid, workspace in self.conn.execute("SELECT rowid, workspace FROM cache")
+                    if workspace.startswith(prefix)
+                ]
+                self.conn.executemany("DELETE FROM cache WHERE rowid = ?", rowids)
+                self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: Persistent semantic cache clear failed: {e}")
+            return 0
+        return len(rowids)
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.conn.close()
+
+    def _serialize(self, embedding: np.ndarray) -> bytes:
+        """Pack an embedding as the little-endian float32 blob sqlite-vec expects."""
+        return np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1).tobytes()
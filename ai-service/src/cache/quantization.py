@@ -0,0 +1,32 @@
+"""
+Embedding Quantization Helpers
+
+This module provides symmetric per-vector int8 quantization so cached
+embeddings take a quarter of the memory of float32.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize a (n, d) float array to int8 codes and per-vector float32 scales."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    max_abs = np.abs(vectors).max(axis=1)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Reconstruct float32 vectors from int8 codes and per-vector scales."""
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def int8_inner_product(codes: np.ndarray,
+                       scales: np.ndarray,
+                       query_codes: np.ndarray,
+                       query_scale: float) -> np.ndarray:
+    """Inner products of int8 rows with an int8 query, accumulated in int32."""
+    return (codes @ query_codes.astype(np.int32)) * scales * np.float32(query_scale)
@@ -0,0 +1,263 @@
+"""
+Semantic Response Cache
+
+This module caches LLM responses keyed by the embedding of the request, so
+near-duplicate requests are served from memory instead of the LLM.
+"""
+
+import copy
+import threading
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .quantization import quantize_int8, dequantize_int8, int8_inner_product
+from .persistent_cache import PersistentCache
+
+# Try to import faiss, fallback to numpy similarity search if not available
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    print("Warning: faiss not available, using numpy similarity search for semantic cache")
+
+
+# Candidates re-scored against the float32 query after the quantized search
+_RERANK_K = 10
+
+
+class _Int8FaissIndex:
+    """FAISS 8-bit scalar quantizer index over L2-normalized vectors."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.index = faiss.IndexScalarQuantizer(
+            dim, faiss.ScalarQuantizer.QT_8bit_uniform, faiss.METRIC_INNER_PRODUCT
+        )
+        # Normalized components lie in [-1, 1], so the range is known without sample data
+        self.index.train(np.stack([-np.ones(dim, dtype=np.float32), np.ones(dim, dtype=np.float32)]))
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def add(self, vectors: np.ndarray):
+        self.index.add(vectors)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index.search(query, min(k, self.index.ntotal))
+
+
+class _Int8NumpyIndex:
+    """Minimal int8 inner-product index used when faiss is not installed."""
+
+    def __init__(self, dim: int):
+        self.codes = np.empty((0, dim), dtype=np.int8)
+        self.scales = np.empty((0,), dtype=np.float32)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.scales)
+
+    def add(self, vectors: np.ndarray):
+        codes, scales = quantize_int8(vectors)
+        self.codes = np.vstack([self.codes, codes])
+        self.scales = np.concatenate([self.scales, scales])
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query_codes, query_scales = quantize_int8(query)
+        scores = int8_inner_product(self.codes, self.scales, query_codes[0], query_scales[0])
+        top = np.argsort(-scores)[:k]
+        return scores[top][None, :], top[None, :]
+
+
+class SemanticCache:
+    """Cache of LLM responses looked up by cosine similarity of embeddings."""
+
+    def __init__(self,
+                 dim: int = 384,
+                 threshold: float = 0.85,
+                 ttl: float = 300.0,
+                 max_entries: int = 10000,
+                 persist_path: Optional[str] = None):
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # One index per namespace, with a parallel list of entries per index
+        self._indexes: Dict[str, Any] = {}
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        # Lookups and adds run in worker threads; an index and its entries change together
+        self._lock = threading.Lock()
+
+        # Optional on-disk tier so hits survive restarts, expiring with the memory tier
+        self._persistent = None
+        if persist_path:
+            try:
+                self._persistent = PersistentCache(
+                    persist_path, dim, max_distance=1.0 - threshold, ttl=ttl
+                )
+            except Exception as e:
+                print(f"Warning: Persistent semantic cache disabled: {e}")
+
+    def lookup(self, embedding: Sequence[float], namespace: str = "default") -> Optional[Dict[str, Any]]:
+        """Return a cached response for a similar query, or None on a miss."""
+        vec = self._normalize(embedding)
+        response = self._lookup_memory(vec, namespace)
+        if response is not None or self._persistent is None:
+            return response
+
+        hit = self._persistent.lookup(vec[0], namespace)
+        if hit is None:
+            return None
+
+        # Warm the in-memory tier for the row's remaining lifetime, so the next hit skips SQLite
+        response, score, remaining = hit
+        self._add_memory(vec, response, namespace, remaining)
+        response["cache_hit"] = True
+        response["cache_similarity"] = score
+        return response
+
+    def _lookup_memory(self, vec: np.ndarray, namespace: str) -> Optional[Dict[str, Any]]:
+        """Look up a normalized embedding in the in-memory tier."""
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if not entries:
+                return None
+
+            _, ids = self._indexes[namespace].search(vec, _RERANK_K)
+            candidates = [int(i) for i in ids[0] if i >= 0]
+            if not candidates:
+                return None
+
+            # Expired candidates are skipped so a live match behind them still hits
+            now = time.time()
+            live = [i for i in candidates if now - entries[i]["ts"] <= entries[i]["ttl"]]
+            if len(live) < len(candidates):
+                self._prune(namespace)
+            if not live:
+                return None
+
+            # Re-score the quantized candidates against the float32 query
+            codes = np.stack([entries[i]["codes"] for i in live])
+            scales = np.array([entries[i]["scale"] for i in live], dtype=np.float32)
+            scores = dequantize_int8(codes, scales) @ vec[0]
+            best = int(np.argmax(scores))
+            score, entry = float(scores[best]), entries[live[best]]
+            if score <= self.threshold:
+                return None
+
+            response = copy.deepcopy(entry["response"])
+            response["cache_hit"] = True
+            response["cache_similarity"] = score
+            return response
+
+    def add(self,
+            embedding: Sequence[float],
+            response: Dict[str, Any],
+            namespace: str = "default",
+            ttl: Optional[float] = None):
+        """Store a response under the embedding of the query that produced it."""
+        vec = self._normalize(embedding)
+        ttl = self.ttl if ttl is None else ttl
+        self._add_memory(vec, response, namespace, ttl)
+        if self._persistent is not None:
+            self._persistent.add(vec[0], response, namespace, ttl)
+
+    def evict_expired(self):
+        """Drop expired entries from both tiers."""
+        with self._lock:
+            for namespace in list(self._entries):
+                self._prune(namespace)
+        if self._persistent is not None:
+            self._persistent.evict_expired()
+
+    def _add_memory(self,
+                    vec: np.ndarray,
+                    response: Dict[str, Any],
+                    namespace: str,
+                    ttl: float):
+        """Store a normalized embedding and response in the in-memory tier."""
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if entries is not None and len(entries) >= self.max_entries:
+                self._prune(namespace)
+
+            if namespace not in self._indexes:
+                self._indexes[namespace] = self._new_index()
+                self._entries[namespace] = []
+
+            self._indexes[namespace].add(vec)
+            codes, scales = quantize_int8(vec)
+            self._entries[namespace].append({
+                "codes": codes[0],
+                "scale": float(scales[0]),
+                "response": copy.deepcopy(response),
+                "ts": time.time(),
+                "ttl": ttl
+            })
+
+    def clear(self, prefix: Optional[str] = None):
+        """Drop entries in namespaces starting with prefix, or all entries, from both tiers."""
+        with self._lock:
+            for namespace in list(self._entries):
+                if prefix is None or namespace.startswith(prefix):
+                    self._indexes.pop(namespace, None)
+                    self._entries.pop(namespace, None)
+        if self._persistent is not None:
+            self._persistent.clear(prefix)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get statistics about the cache."""
+        return {
+            "backend": "faiss-sq8" if FAISS_AVAILABLE else "numpy-int8",
+            "namespaces": len(self._entries),
+            "entries": sum(len(entries) for entries in self._entries.values()),
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "persistent": self._persistent is not None
+        }
+
+    def _new_index(self):
+        """Create an empty int8 inner-product index."""
+        if FAISS_AVAILABLE:
+            return _Int8FaissIndex(self.dim)
+        return _Int8NumpyIndex(self.dim)
+
+    def _normalize(self, embedding: Sequence[float]) -> np.ndarray:
+        """L2-normalize an embedding so inner product equals cosine similarity."""
+        vec = np.ascontiguousarray(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        if FAISS_AVAILABLE:
+            faiss.normalize_L2(vec)
+        else:
+            norm = np.linalg.norm(vec)
+            if norm > 0:
+                vec /= norm
+        return vec
+
+    def _prune(self, namespace: str):
+        """Rebuild a namespace index without expired entries, capped at max_entries."""
+        now = time.time()
+        live = [
+            entry for entry in self._entries.get(namespace, [])
+            if now - entry["ts"] <= entry["ttl"]
+        ]
+        # Keep the most recent half when the cache is still full
+        if len(live) >= self.max_entries:
+            live = live[-(self.max_entries // 2):]
+
+        if not live:
+            self._indexes.pop(namespace, None)
+            self._entries.pop(namespace, None)
+            return
+
+        index = self._new_index()
+        index.add(dequantize_int8(
+            np.stack([entry["codes"] for entry in live]),
+            np.array([entry["scale"] for entry in live], dtype=np.float32)
+        ))
+        self._indexes[namespace] = index
+        self._entries[namespace] = live
@@ -4,14 +4,22 @@ Ollama LLM Service for Test Generation
 This module provides integration with Ollama for local LLM-based test generation.
 """
 
-import requests
-import json
-from typing import Dict, Any, List, Optional
-from pydantic import BaseModel
+import httpx
+import msgspec
+from string import Template
+from typing import Dict, Any, AsyncIterator, List, Optional
 import time
 
+# Try to import tiktoken, fallback to a characters-per-token estimate if not available
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+    print("Warning: tiktoken not available, estimating prompt tokens from length")
 
-class OllamaResponse(BaseModel):
+
+class OllamaResponse(msgspec.Struct):
     """Response model for Ollama API."""
     model: str
     created_at: str
@@ -26,60 +34,162 @@ class OllamaResponse(BaseModel):
     eval_duration: Optional[int] = None
 
 
+# Built once so every response is decoded straight into OllamaResponse
+_RESPONSE_DECODER = msgspec.json.Decoder(OllamaResponse)
+
+# Fixed instruction headers. Each template starts with its header byte for byte,
+# so Ollama can reuse the cached KV prefix and only evaluate the variable tail.
+_TEST_GENERATION_HEADER = """
+You are an expert test automation engineer. Generate a Playwright test based on the context and requirements below.
+
+Generate a complete Playwright test that:
+1. Follows the existing code patterns and conventions
+2. Uses proper TypeScript syntax
+3. Includes meaningful test descriptions
+4. Has proper assertions and error handling
+5. Uses Page Object Model if applicable
+6. Follows best practices for test automation
+
+Return only the TypeScript test code, no explanations or markdown formatting.
+"""
+
+_CODE_ANALYSIS_HEADER = """
+You are an expert code reviewer. Analyze the test code below and provide suggestions for improvement.
+
+Please provide:
+1. Code quality improvements
+2. Better selectors or locators
+3. Performance optimizations
+4. Maintainability suggestions
+5. Best practices recommendations
+
+Be specific and actionable. Format your response as a structured list.
+"""
+
+_TEST_MODIFICATION_HEADER = """
+You are an expert test automation engineer. Modify the test code below based on the request.
+
+Please modify the code to:
+1. Address the modification request
+2. Maintain existing code structure and patterns
+3. Keep all existing functionality
+4. Follow the same coding style
+5. Ensure the test remains valid and executable
+
+Return only the modified TypeScript code, no explanations.
+"""
+
+# Prompt templates, compiled once at import; variable sections come last
+_TEST_GENERATION_TEMPLATE = Template(_TEST_GENERATION_HEADER + """
+CONTEXT (existing codebase patterns):
+$context
+
+REQUIREMENTS:
+$requirements
+""")
+
+_CODE_ANALYSIS_TEMPLATE = Template(_CODE_ANALYSIS_HEADER + """
+CODE:
+$code
+""")
+
+_TEST_MODIFICATION_TEMPLATE = Template(_TEST_MODIFICATION_HEADER + """
+ORIGINAL CODE:
+$original_code
+
+MODIFICATION REQUEST:
+$modification_request
+""")
+
+
 class OllamaService:
     """Service for interacting with Ollama LLM."""
     
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "mistral"):
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 model: str = "mistral:7b-instruct-q4_K_M",
+                 keep_alive: str = "30m",
+                 num_ctx: int = 8192,
+                 max_prompt_tokens: int = 6000):
         self.base_url = base_url.rstrip('/')
         self.model = model
-        self.session = requests.Session()
-        self.session.timeout = 60  # 60 seconds timeout
+        # How long Ollama keeps the model resident between requests
+        self.keep_alive = keep_alive
+        # Context window requested from Ollama, and the prompt budget within it
+        self.num_ctx = num_ctx
+        self.max_prompt_tokens = max_prompt_tokens
+        self._encoder = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                # Not Mistral's tokenizer, but close enough for budgeting
+                self._encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"Warning: tiktoken encoding unavailable, estimating prompt tokens from length: {e}")
+        # Header token counts, sent as num_keep so the shared prefix survives context shifts
+        self._header_tokens = {
+            header: self._count_tokens(header)
+            for header in (_TEST_GENERATION_HEADER, _CODE_ANALYSIS_HEADER, _TEST_MODIFICATION_HEADER)
+        }
+        # Persistent connection pool; reads get a long timeout for slow decodes
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(60.0, read=600.0),
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            http2=True
+        )
+    
+    async def aclose(self):
+        """Close the underlying HTTP connection pool."""
+        await self.client.aclose()
     
-    def is_available(self) -> bool:
+    async def warmup(self) -> bool:
+        """Preload the model so the first real request avoids a cold load."""
+        try:
+            response = await self.client.post(
+                "/api/generate",
+                # Same num_ctx as real requests, or Ollama reloads the runner on first use
+                json=self._build_payload("", False, {})
+            )
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+    
+    async def is_available(self) -> bool:
         """Check if Ollama is running and accessible."""
         try:
-            response = self.session.get(f"{self.base_url}/api/tags")
+            response = await self.client.get("/api/tags")
             return response.status_code == 200
-        except requests.RequestException:
+        except httpx.HTTPError:
             return False
     
-    def get_models(self) -> List[str]:
+    async def get_models(self) -> List[str]:
         """Get list of available models."""
         try:
-            response = self.session.get(f"{self.base_url}/api/tags")
+            response = await self.client.get("/api/tags")
             if response.status_code == 200:
                 data = response.json()
                 return [model["name"] for model in data.get("models", [])]
             return []
-        except requests.RequestException:
+        except httpx.HTTPError:
             return []
     
-    def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """Generate response from Ollama."""
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            **kwargs
-        }
+        payload = self._build_payload(prompt, False, kwargs)
         
         try:
-            response = self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
+            response = await self.client.post("/api/generate", json=payload)
             
             if response.status_code == 200:
-                data = response.json()
+                data = _RESPONSE_DECODER.decode(response.content)
                 return {
                     "success": True,
-                    "content": data.get("response", ""),
+                    "content": data.response,
                     "metadata": {
-                        "model": data.get("model"),
-                        "total_duration": data.get("total_duration"),
-                        "eval_count": data.get("eval_count"),
-                        "prompt_eval_count": data.get("prompt_eval_count")
+                        "model": data.model,
+                        "total_duration": data.total_duration,
+                        "eval_count": data.eval_count,
+                        "prompt_eval_count": data.prompt_eval_count
                     }
                 }
             else:
@@ -89,101 +199,131 @@ class OllamaService:
                     "error": f"HTTP {response.status_code}: {response.text}"
                 }
                 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             return {
                 "success": False,
                 "content": "",
                 "error": f"Request failed: {str(e)}"
             }
+        except msgspec.DecodeError as e:
+            return {
+                "success": False,
+                "content": "",
+                "error": f"Invalid response from Ollama: {str(e)}"
+            }
     
-    def generate_test(self, context: str, requirements: str) -> Dict[str, Any]:
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Stream response tokens from Ollama as they are decoded."""
+        payload = self._build_payload(prompt, True, kwargs)
+        
+        async with self.client.stream("POST", "/api/generate", json=payload) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise RuntimeError(f"HTTP {response.status_code}: {body.decode('utf-8', 'replace')}")
+            
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = _RESPONSE_DECODER.decode(line)
+                if data.response:
+                    yield data.response
+                if data.done:
+                    break
+    
+    def _build_payload(self, prompt: str, stream: bool, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Build an /api/generate request body with the configured context window."""
+        options = {"num_ctx": self.num_ctx, **kwargs.pop("options", {})}
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": options,
+            **kwargs
+        }
+    
+    async def generate_test(self, context: str, requirements: str) -> Dict[str, Any]:
         """Generate test code based on context and requirements."""
         prompt = self._build_test_generation_prompt(context, requirements)
-        return self.generate(prompt)
+        return await self.generate(prompt, options=self._prefix_options(_TEST_GENERATION_HEADER))
     
-    def analyze_code(self, code: str) -> Dict[str, Any]:
+    def generate_test_stream(self, context: str, requirements: str) -> AsyncIterator[str]:
+        """Stream generated test code based on context and requirements."""
+        prompt = self._build_test_generation_prompt(context, requirements)
+        return self.generate_stream(prompt, options=self._prefix_options(_TEST_GENERATION_HEADER))
+    
+    async def analyze_code(self, code: str) -> Dict[str, Any]:
         """Analyze code and provide suggestions."""
         prompt = self._build_code_analysis_prompt(code)
-        return self.generate(prompt)
+        return await self.generate(prompt, options=self._prefix_options(_CODE_ANALYSIS_HEADER))
     
-    def modify_test(self, original_code: str, modification_request: str) -> Dict[str, Any]:
+    async def modify_test(self, original_code: str, modification_request: str) -> Dict[str, Any]:
         """Modify existing test code based on request."""
         prompt = self._build_test_modification_prompt(original_code, modification_request)
-        return self.generate(prompt)
+        return await self.generate(prompt, options=self._prefix_options(_TEST_MODIFICATION_HEADER))
     
     def _build_test_generation_prompt(self, context: str, requirements: str) -> str:
         """Build prompt for test generation."""
-        return f"""
-You are an expert test automation engineer. Generate a Playwright test based on the following context and requirements.
-
-CONTEXT (existing codebase patterns):
-{context}
-
-REQUIREMENTS:
-{requirements}
-
-Generate a complete Playwright test that:
-1. Follows the existing code patterns and conventions
-2. Uses proper TypeScript syntax
-3. Includes meaningful test descriptions
-4. Has proper assertions and error handling
-5. Uses Page Object Model if applicable
-6. Follows best practices for test automation
-
-Return only the TypeScript test code, no explanations or markdown formatting.
-"""
+        return self._render_within_budget(
+            _TEST_GENERATION_HEADER, _TEST_GENERATION_TEMPLATE, "context", context,
+            requirements=requirements
+        )
     
     def _build_code_analysis_prompt(self, code: str) -> str:
         """Build prompt for code analysis."""
-        return f"""
-You are an expert code reviewer. Analyze the following test code and provide suggestions for improvement.
-
-CODE:
-{code}
-
-Please provide:
-1. Code quality improvements
-2. Better selectors or locators
-3. Performance optimizations
-4. Maintainability suggestions
-5. Best practices recommendations
-
-Be specific and actionable. Format your response as a structured list.
-"""
+        return self._render_within_budget(_CODE_ANALYSIS_HEADER, _CODE_ANALYSIS_TEMPLATE, "code", code)
     
     def _build_test_modification_prompt(self, original_code: str, modification_request: str) -> str:
         """Build prompt for test modification."""
-        return f"""
-You are an expert test automation engineer. Modify the following test code based on the request.
-
-ORIGINAL CODE:
-{original_code}
-
-MODIFICATION REQUEST:
-{modification_request}
-
-Please modify the code to:
-1. Address the modification request
-2. Maintain existing code structure and patterns
-3. Keep all existing functionality
-4. Follow the same coding style
-5. Ensure the test remains valid and executable
-
-Return only the modified TypeScript code, no explanations.
-"""
+        return self._render_within_budget(
+            _TEST_MODIFICATION_HEADER, _TEST_MODIFICATION_TEMPLATE, "original_code", original_code,
+            modification_request=modification_request
+        )
+    
+    def _count_tokens(self, text: str) -> int:
+        """Estimate the number of prompt tokens in text."""
+        if self._encoder is not None:
+            return len(self._encoder.encode(text, disallowed_special=()))
+        return len(text) // 4
+    
+    def _prefix_options(self, header: str) -> Dict[str, Any]:
+        """Ollama options that keep a prompt's fixed header in the KV cache."""
+        return {"num_keep": self._header_tokens[header]}
+    
+    def _render_within_budget(self,
+                              header: str,
+                              template: Template,
+                              field: str,
+                              value: str,
+                              **fixed: str) -> str:
+        """Render a template, truncating one field so the prompt fits max_prompt_tokens."""
+        prompt = template.substitute(fixed, **{field: value})
+        assert prompt.startswith(header), "prompt must start with its fixed header"
+        if self._count_tokens(prompt) <= self.max_prompt_tokens:
+            return prompt
+        
+        # Binary search the longest prefix of the field that still fits
+        lo, hi = 0, len(value)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._count_tokens(template.substitute(fixed, **{field: value[:mid]})) <= self.max_prompt_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return template.substitute(fixed, **{field: value[:lo]})
     
-    def health_check(self) -> Dict[str, Any]:
+    async def health_check(self) -> Dict[str, Any]:
         """Perform a health check on the Ollama service."""
         try:
             # Check if service is available
-            if not self.is_available():
+            if not await self.is_available():
                 return {
                     "status": "unavailable",
                     "error": "Ollama service is not running or accessible"
                 }
             
             # Check if model is available
-            models = self.get_models()
+            models = await self.get_models()
             if self.model not in models:
                 return {
                     "status": "model_not_found",
@@ -192,7 +332,7 @@ Return only the modified TypeScript code, no explanations.
                 }
             
             # Test generation
-            test_response = self.generate("Hello, this is a test.")
+            test_response = await self.generate("Hello, this is a test.")
             if not test_response["success"]:
                 return {
                     "status": "generation_failed",
@@ -6,5 +6,7 @@ for codebase indexing and context retrieval.
 """
 
 from .code_indexer import CodeIndexer
+from .search_batch import SearchBatch
+from .embedding_cache import EmbeddingCache
 
-__all__ = ['CodeIndexer'] 
\ No newline at end of file
+__all__ = ['CodeIndexer', 'SearchBatch', 'EmbeddingCache'] 
\ No newline at end of file
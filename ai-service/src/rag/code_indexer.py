@@ -4,15 +4,26 @@ Code Indexer for RAG (Retrieval-Augmented Generation)
 This module handles indexing of code files for context-aware test generation.
 """
 
+import asyncio
+import contextlib
+import hashlib
+import json
 import os
 import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import chromadb
 from chromadb.config import Settings
 import tree_sitter
 from tree_sitter import Language, Parser
-import markdown
+import numpy as np
+
+from .embedding_cache import EmbeddingCache
+from .search_batch import SearchBatch
 
 # Try to import sentence_transformers, fallback to simple embedding if not available
 try:
@@ -22,11 +33,91 @@ except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
     print("Warning: sentence_transformers not available, using simple embedding fallback")
 
+# Try to import torch for accelerator detection, fallback to CPU if not available
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+# Try to import scikit-learn for the fallback embedding, fallback to numpy hashing if not available
+try:
+    from sklearn.feature_extraction.text import HashingVectorizer
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+# Chunks buffered across files before one embedding call and write
+EMBED_FLUSH_SIZE = 1024
+
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Size limits past which files are assumed to be generated or vendored
+MAX_CODE_BYTES = 512 * 1024
+MAX_DOC_BYTES = 2 * 1024 * 1024
+
+# Lockfiles, bundles and source maps that match indexed extensions but are not worth embedding
+_GENERATED_FILE = re.compile(
+    r'^(?:package-lock\.json|npm-shrinkwrap\.json|yarn\.lock|pnpm-lock\.yaml)$'
+    r'|\.(?:min|bundle)\.(?:js|css)$|\.map$'
+)
+
+# Markdown syntax stripped from docs before chunking: block prefixes, emphasis, code
+# fences and inline HTML. Newlines are never matched so line splitting is unchanged.
+_MARKDOWN_MARKUP = re.compile(
+    r'^[ \t]*(?:#{1,6}|>+|[-*+]|\d+[.)])[ \t]+|[`*~]+|<[^<>\n]+>',
+    re.MULTILINE
+)
+
+# Bytes expected in text files: printable ASCII, common control characters and UTF-8
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+
+
+def _looks_binary(sample: bytes) -> bool:
+    """Guess whether a file is binary from a sample of its first bytes."""
+    if b'\0' in sample:
+        return True
+    return len(sample.translate(None, _TEXT_BYTES)) > 0.3 * len(sample)
+
+
+def _default_onnx_file() -> str:
+    """Pick the int8 ONNX export on CPUs with AVX-512, otherwise the fp32 export."""
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            if 'avx512' in f.read():
+                return 'onnx/model_qint8_avx512.onnx'
+    except OSError:
+        pass
+    return 'onnx/model.onnx'
+
+def _default_device() -> str:
+    """Pick CUDA, then Apple MPS, then CPU for the embedding model."""
+    if TORCH_AVAILABLE:
+        if torch.cuda.is_available():
+            return 'cuda'
+        mps = getattr(torch.backends, 'mps', None)
+        if mps is not None and mps.is_available():
+            return 'mps'
+    return 'cpu'
+
+def _inference_mode():
+    """Disable autograd bookkeeping around model calls when torch is installed."""
+    if TORCH_AVAILABLE:
+        return torch.inference_mode()
+    return contextlib.nullcontext()
+
+# Definitions captured as chunks, as valid node types for each grammar
+_JS_CHUNK_QUERY = "(function_declaration) @chunk (class_declaration) @chunk (method_definition) @chunk"
+_PY_CHUNK_QUERY = "(function_definition) @chunk (class_definition) @chunk"
+
 
 class CodeIndexer:
     """Indexes code files for RAG-based test generation."""
     
-    def __init__(self, db_path: str = "./chroma_db"):
+    def __init__(self,
+                 db_path: str = "./chroma_db",
+                 embedding_backend: str = "onnx",
+                 onnx_file: Optional[str] = None):
         self.db_path = db_path
         self.client = chromadb.PersistentClient(path=db_path)
         self.collection = self.client.get_or_create_collection(
@@ -34,11 +125,43 @@ class CodeIndexer:
             metadata={"description": "Indexed codebase for test generation"}
         )
         
+        # Larger batches keep an accelerator busy; CPU throughput peaks much earlier
+        self.device = _default_device()
+        self.encode_batch_size = 64 if self.device == 'cpu' else 256
+        
         # Initialize sentence transformer for embeddings if available
         if SENTENCE_TRANSFORMERS_AVAILABLE:
-            self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embedder, self.embedding_model = self._load_embedder(embedding_backend, onnx_file)
+            self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
         else:
+            # The sklearn and crc32 hashers bucket n-grams differently, so they must not share cached vectors
+            self.embedding_model = 'hashed-char-3-5-sklearn' if SKLEARN_AVAILABLE else 'hashed-char-3-5-crc32'
             self.embedder = None
+            self.embedding_dim = 384
+        
+        # Hashed character n-grams, so the fallback still retrieves similar text
+        self._hasher = None
+        if SKLEARN_AVAILABLE:
+            self._hasher = HashingVectorizer(
+                n_features=self.embedding_dim,
+                alternate_sign=False,
+                norm='l2',
+                analyzer='char_wb',
+                ngram_range=(3, 5)
+            )
+        
+        # Embeddings from previous runs, so unchanged chunks skip the model
+        try:
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(db_path, "emb_cache.sqlite"),
+                self._embedding_signature()
+            )
+        except Exception as e:
+            print(f"Warning: Embedding cache disabled: {e}")
+            self.embedding_cache = None
+        
+        # Per-file stat and content hash from the last run, for incremental indexing
+        self.manifest_path = os.path.join(db_path, "index_manifest.json")
         
         # Setup tree-sitter for code parsing
         self._setup_tree_sitter()
@@ -54,6 +177,27 @@ class CodeIndexer:
             '.pytest_cache', '.venv', 'venv', 'env', '.env'
         }
     
+    def _load_embedder(self, backend: str, onnx_file: Optional[str]):
+        """Load the embedding model on the ONNX Runtime backend, falling back to PyTorch."""
+        # The ONNX exports target CPU; on an accelerator PyTorch is the faster path
+        if backend == "onnx" and self.device == 'cpu':
+            onnx_file = onnx_file or _default_onnx_file()
+            try:
+                embedder = SentenceTransformer(
+                    EMBEDDING_MODEL,
+                    backend="onnx",
+                    model_kwargs={"file_name": onnx_file}
+                )
+                return embedder, f"{EMBEDDING_MODEL}@{onnx_file}"
+            except Exception as e:
+                print(f"Warning: ONNX embedding backend unavailable, using PyTorch: {e}")
+        
+        embedder = SentenceTransformer(EMBEDDING_MODEL, device=self.device)
+        if self.device == 'cuda':
+            # Half precision halves memory and runs on tensor cores
+            return embedder.half(), f"{EMBEDDING_MODEL}@fp16"
+        return embedder, EMBEDDING_MODEL
+    
     def _setup_tree_sitter(self):
         """Setup tree-sitter for code parsing."""
         try:
@@ -94,62 +238,317 @@ class CodeIndexer:
                 self.js_lang = None
                 self.py_lang = None
         
-        self.parser = Parser() if self.tree_sitter_available else None
+        # Grammar per file extension; parsers are created per thread since they are not thread-safe
+        self.languages = {}
+        if self.tree_sitter_available:
+            self.languages = {
+                '.ts': self.ts_lang,
+                '.tsx': self.ts_lang,
+                '.js': self.js_lang,
+                '.jsx': self.js_lang,
+                '.py': self.py_lang
+            }
+        self._local = threading.local()
+        self._build_queries()
+    
+    def _build_queries(self):
+        """Compile one chunk-capturing query per grammar."""
+        self.queries = {}
+        for language in self.languages.values():
+            if id(language) not in self.queries:
+                pattern = _PY_CHUNK_QUERY if language is self.py_lang else _JS_CHUNK_QUERY
+                self.queries[id(language)] = language.query(pattern)
+    
+    def _get_parser(self, suffix: str) -> Optional[Parser]:
+        """Return this thread's parser for a file extension, creating it on first use."""
+        language = self.languages.get(suffix)
+        if language is None:
+            return None
+        
+        parsers = getattr(self._local, "parsers", None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+        parser = parsers.get(id(language))
+        if parser is None:
+            parser = Parser()
+            parser.set_language(language)
+            parsers[id(language)] = parser
+        return parser
     
-    def index_codebase(self, root_path: str) -> Dict[str, Any]:
-        """Index the entire codebase."""
+    def index_codebase(self, root_path: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Index the entire codebase (blocking wrapper around aindex_codebase)."""
+        return asyncio.run(self.aindex_codebase(root_path, batch_size=batch_size))
+    
+    async def aindex_codebase(self,
+                              root_path: str,
+                              concurrency: int = 8,
+                              batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Index the codebase incrementally, processing and embedding files concurrently."""
         root_path = Path(root_path)
         indexed_files = []
+        skipped_files = 0
+        removed_files = []
         total_chunks = 0
         
         print(f"🔍 Indexing codebase at: {root_path}")
         
-        for file_path in root_path.rglob('*'):
-            if file_path.is_file() and not self._should_exclude(file_path):
+        file_paths = await asyncio.to_thread(self._discover_files, root_path)
+        
+        # Warm start: nothing under the root changed since the last completed run
+        manifest_hash = await asyncio.to_thread(self._stat_manifest_hash, root_path, file_paths)
+        stored_hash = await asyncio.to_thread(self._load_root_hash, root_path)
+        if stored_hash == manifest_hash and self.collection.count() > 0:
+            print(f"🎯 Index is up to date: {len(file_paths)} files unchanged")
+            return {
+                "indexed_files": [],
+                "skipped_files": len(file_paths),
+                "removed_files": [],
+                "total_chunks": 0,
+                "collection_size": self.collection.count()
+            }
+        
+        previous = await asyncio.to_thread(self._load_manifest)
+        manifest: Dict[str, Dict[str, Any]] = {}
+        
+        # Dedicated pool for reads and parsing, so indexing does not starve the default executor
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="indexer")
+        # Bounded queue plus the semaphore below keep scanning in step with the writer
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * EMBED_FLUSH_SIZE)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _index_file(file_path: Path):
+            nonlocal skipped_files, total_chunks
+            key = str(file_path)
+            # Held until the file's chunks are queued, so at most `concurrency` files are
+            # scanned or waiting on the writer at a time
+            async with semaphore:
                 try:
-                    chunks = self._process_file(file_path)
+                    entry, chunks = await loop.run_in_executor(
+                        executor, self._scan_file, file_path, previous.get(key)
+                    )
+                    if chunks is None:
+                        manifest[key] = entry
+                        skipped_files += 1
+                        return
+                    
+                    # Drop the file's old rows before its new chunks are written
+                    if key in previous:
+                        await queue.put(key)
+                    for i, chunk in enumerate(chunks):
+                        await queue.put((f"{file_path}_{i}", chunk["content"], chunk["metadata"]))
+                    manifest[key] = entry
                     if chunks:
-                        self._add_to_collection(file_path, chunks)
-                        indexed_files.append(str(file_path))
+                        indexed_files.append(key)
                         total_chunks += len(chunks)
                         print(f"  ✅ Indexed: {file_path.name} ({len(chunks)} chunks)")
                 except Exception as e:
                     print(f"  ❌ Error indexing {file_path}: {e}")
+                    # Keep the old rows; the stale entry makes the next run retry the file
+                    if key in previous:
+                        manifest[key] = previous[key]
         
-        print(f"🎯 Indexing complete: {len(indexed_files)} files, {total_chunks} chunks")
+        writer = asyncio.create_task(self._drain_queue(queue, batch_size))
+        try:
+            await asyncio.gather(*[_index_file(file_path) for file_path in file_paths])
+            
+            # Remove rows for files under this root that were deleted or are now excluded
+            for key, entry in previous.items():
+                if key in manifest:
+                    continue
+                if Path(key).is_relative_to(root_path):
+                    removed_files.append(key)
+                    await queue.put(key)
+                else:
+                    # Other roots are left alone so indexing one tree keeps the rest
+                    manifest[key] = entry
+        finally:
+            await queue.put(None)
+            await writer
+            executor.shutdown(wait=False)
+        
+        # Hash the stats that were actually indexed; files that failed are left out so
+        # the next run does not take the fast path past them
+        indexed_stats = [
+            (str(file_path), manifest[str(file_path)]["mtime_ns"], manifest[str(file_path)]["size"])
+            for file_path in file_paths if str(file_path) in manifest
+        ]
+        await asyncio.to_thread(
+            self._save_manifest, manifest, root_path, self._manifest_hash(root_path, indexed_stats)
+        )
+        
+        print(f"🎯 Indexing complete: {len(indexed_files)} files, {total_chunks} chunks, {skipped_files} unchanged")
         
         return {
             "indexed_files": indexed_files,
+            "skipped_files": skipped_files,
+            "removed_files": removed_files,
             "total_chunks": total_chunks,
             "collection_size": self.collection.count()
         }
     
-    def _should_exclude(self, file_path: Path) -> bool:
-        """Check if file should be excluded from indexing."""
-        # Check if any parent directory is in exclude list
-        for parent in file_path.parents:
-            if parent.name in self.exclude_dirs:
-                return True
+    async def _drain_queue(self, queue: asyncio.Queue, batch_size: Optional[int]):
+        """Buffer chunks across files, embedding and writing them in large batches.
         
-        # Check file extension
-        extension = file_path.suffix.lower()
-        return not (
-            extension in self.code_extensions or
-            extension in self.doc_extensions or
-            extension in self.config_extensions
-        )
+        Items are (id, text, metadata) chunks, or a file path whose existing rows
+        should be deleted first.
+        """
+        pending = []
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                
+                if isinstance(item, str):
+                    await asyncio.to_thread(self.collection.delete, where={"file_path": item})
+                    continue
+                
+                pending.append(item)
+                if len(pending) >= EMBED_FLUSH_SIZE:
+                    await asyncio.to_thread(self._flush_pending, pending, batch_size)
+                    pending = []
+        except Exception:
+            # Keep consuming until the sentinel so producers blocked on the bounded queue finish
+            while await queue.get() is not None:
+                pass
+            raise
+        
+        if pending:
+            await asyncio.to_thread(self._flush_pending, pending, batch_size)
+    
+    def _flush_pending(self, pending: List[tuple], batch_size: Optional[int]):
+        """Embed buffered (id, text, metadata) chunks in one call, then write them."""
+        ids = [item[0] for item in pending]
+        documents = [item[1] for item in pending]
+        metadatas = [item[2] for item in pending]
+        embeddings = self._embed_cached(documents)
+        
+        # One upsert per flush unless batch_size asks for smaller writes; the
+        # client also caps rows per call
+        step = min(batch_size or len(ids), getattr(self.client, "max_batch_size", len(ids)))
+        for start in range(0, len(ids), step):
+            end = start + step
+            self._add_to_collection(
+                ids[start:end], embeddings[start:end], documents[start:end], metadatas[start:end]
+            )
+    
+    def _discover_files(self, root_path: Path) -> List[Path]:
+        """List the files under root_path that should be indexed."""
+        extensions = self.code_extensions | self.doc_extensions | self.config_extensions
+        file_paths = []
+        
+        for dirpath, dirnames, filenames in os.walk(root_path):
+            # Prune excluded directories so their subtrees are never walked
+            dirnames[:] = [name for name in dirnames if name not in self.exclude_dirs]
+            for name in filenames:
+                if os.path.splitext(name)[1].lower() in extensions and not _GENERATED_FILE.search(name):
+                    file_paths.append(Path(dirpath, name))
+        
+        return file_paths
+    
+    def _scan_file(self,
+                   file_path: Path,
+                   previous: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]]]:
+        """Return a file's manifest entry and chunks, with chunks None if it is unchanged."""
+        st = file_path.stat()
+        if previous and previous["mtime_ns"] == st.st_mtime_ns and previous["size"] == st.st_size:
+            return previous, None
+        
+        # Oversized files are recorded but never read, so they also drop any earlier rows
+        max_bytes = MAX_CODE_BYTES if file_path.suffix.lower() in self.code_extensions else MAX_DOC_BYTES
+        if st.st_size > max_bytes:
+            return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": None}, []
+        
+        # Touched but identical files only need their stat refreshed
+        data = file_path.read_bytes()
+        entry = {
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "hash": hashlib.blake2b(data, digest_size=16).hexdigest()
+        }
+        if previous and previous["hash"] == entry["hash"]:
+            return entry, None
+        
+        if _looks_binary(data[:4096]):
+            return entry, []
+        return entry, self._process_file(file_path, data)
+    
+    def _read_manifest(self) -> Dict[str, Any]:
+        """Read the raw manifest written by the last indexing run."""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
     
-    def _process_file(self, file_path: Path) -> List[Dict[str, Any]]:
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """Load the file manifest written by the last indexing run."""
+        manifest = self._read_manifest()
+        files = manifest.get("files", {})
+        if manifest.get("embedding_model") != self._embedding_signature():
+            # Embedded with another model: re-index everything, replacing the old rows
+            return {key: {**entry, "mtime_ns": None, "hash": None} for key, entry in files.items()}
+        return files
+    
+    def _load_root_hash(self, root_path: Path) -> Optional[str]:
+        """Return the manifest hash stored by the last completed run over a root."""
+        return self._read_manifest().get("root_hashes", {}).get(str(root_path))
+    
+    def _save_manifest(self,
+                       files: Dict[str, Dict[str, Any]],
+                       root_path: Path,
+                       manifest_hash: str):
+        """Atomically write the file manifest and the root's manifest hash."""
+        root_hashes = self._read_manifest().get("root_hashes", {})
+        root_hashes[str(root_path)] = manifest_hash
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "embedding_model": self._embedding_signature(),
+                "files": files,
+                "root_hashes": root_hashes
+            }, f)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def _stat_manifest_hash(self, root_path: Path, file_paths: List[Path]) -> str:
+        """Hash the current path, mtime and size of every file to index."""
+        stats = []
+        for file_path in file_paths:
+            try:
+                st = file_path.stat()
+            except OSError:
+                continue
+            stats.append((str(file_path), st.st_mtime_ns, st.st_size))
+        return self._manifest_hash(root_path, stats)
+    
+    def _manifest_hash(self, root_path: Path, stats: List[Tuple[str, int, int]]) -> str:
+        """Hash a root's file stats together with the embedding model signature."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{root_path}\0{self._embedding_signature()}\0".encode('utf-8'))
+        for path, mtime_ns, size in sorted(stats):
+            digest.update(f"{path}\0{mtime_ns}\0{size}\n".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def _embedding_signature(self) -> str:
+        """Identify the embedding model so stored vectors are never mixed across models."""
+        return f"{self.embedding_model}:{self.embedding_dim}"
+    
+    def _process_file(self, file_path: Path, data: Optional[bytes] = None) -> List[Dict[str, Any]]:
         """Process a single file and extract chunks."""
         extension = file_path.suffix.lower()
         
+        if data is None:
+            data = file_path.read_bytes()
         try:
-            content = file_path.read_text(encoding='utf-8')
+            content = data.decode('utf-8')
         except UnicodeDecodeError:
             return []
         
         if extension in self.code_extensions:
-            return self._process_code_file(file_path, content)
+            return self._process_code_file(file_path, content, data)
         elif extension in self.doc_extensions:
             return self._process_doc_file(file_path, content)
         elif extension in self.config_extensions:
@@ -157,74 +556,77 @@ class CodeIndexer:
         
         return []
     
-    def _process_code_file(self, file_path: Path, content: str) -> List[Dict[str, Any]]:
+    def _process_code_file(self, file_path: Path, content: str, data: bytes) -> List[Dict[str, Any]]:
         """Process code files with syntax-aware chunking."""
         chunks = []
         
-        if self.tree_sitter_available and self.parser:
-            # Set appropriate language for parser
-            if file_path.suffix in {'.ts', '.tsx'}:
-                self.parser.set_language(self.ts_lang)
-            elif file_path.suffix in {'.js', '.jsx'}:
-                self.parser.set_language(self.js_lang)
-            elif file_path.suffix == '.py':
-                self.parser.set_language(self.py_lang)
-            
+        parser = self._get_parser(file_path.suffix)
+        if parser is not None:
             try:
-                tree = self.parser.parse(bytes(content, 'utf8'))
-                chunks = self._extract_code_chunks(tree, content, file_path)
+                # Parse the bytes already read; tree-sitter offsets are byte offsets
+                tree = parser.parse(data)
+                query = self.queries[id(self.languages[file_path.suffix])]
+                chunks = self._extract_code_chunks(tree, query, data, file_path)
             except Exception as e:
                 # Fallback to simple chunking if parsing fails
                 chunks = self._simple_chunking(content, file_path)
+            
+            # Files of top-level statements only (e.g. test specs) have no definitions
+            if not chunks:
+                chunks = self._simple_chunking(content, file_path)
         else:
-            # Use simple chunking if tree-sitter is not available
+            # Use simple chunking if tree-sitter is not available for this language
             chunks = self._simple_chunking(content, file_path)
         
         return chunks
     
-    def _extract_code_chunks(self, tree, content: str, file_path: Path) -> List[Dict[str, Any]]:
+    def _extract_code_chunks(self, tree, query, data: bytes, file_path: Path) -> List[Dict[str, Any]]:
         """Extract meaningful chunks from parsed code."""
         chunks = []
+        view = memoryview(data)
         
-        # Extract functions, classes, and important code blocks
-        cursor = tree.walk()
-        
-        while cursor.goto_next_sibling():
-            node = cursor.node
-            
-            if node.type in ['function_declaration', 'class_declaration', 'method_definition']:
-                chunk_text = content[node.start_byte:node.end_byte]
-                if len(chunk_text.strip()) > 50:  # Minimum meaningful size
-                    chunks.append({
-                        "content": chunk_text,
-                        "type": node.type,
-                        "start_line": node.start_point[0] + 1,
-                        "end_line": node.end_point[0] + 1,
-                        "metadata": {
-                            "file_path": str(file_path),
-                            "node_type": node.type,
-                            "language": file_path.suffix[1:]
-                        }
-                    })
+        # Functions, classes and methods at any depth, captured in one pass
+        for node, _ in query.captures(tree.root_node):
+            chunk_text = str(view[node.start_byte:node.end_byte], 'utf-8', 'replace')
+            if len(chunk_text.strip()) > 50:  # Minimum meaningful size
+                chunks.append({
+                    "content": chunk_text,
+                    "type": node.type,
+                    "start_line": node.start_point[0] + 1,
+                    "end_line": node.end_point[0] + 1,
+                    "metadata": {
+                        "file_path": str(file_path),
+                        "node_type": node.type,
+                        "language": file_path.suffix[1:]
+                    }
+                })
         
         return chunks
     
     def _simple_chunking(self, content: str, file_path: Path) -> List[Dict[str, Any]]:
         """Simple chunking for files that can't be parsed."""
         chunks = []
-        lines = content.split('\n')
         chunk_size = 50  # lines per chunk
+        total_lines = content.count('\n') + 1
         
-        for i in range(0, len(lines), chunk_size):
-            chunk_lines = lines[i:i + chunk_size]
-            chunk_text = '\n'.join(chunk_lines)
+        # Slice chunks straight out of content at every chunk_size-th newline
+        start = 0
+        for first_line in range(0, total_lines, chunk_size):
+            end = start
+            for _ in range(chunk_size):
+                end = content.find('\n', end) + 1
+                if end == 0:
+                    break
+            
+            chunk_text = content[start:end - 1] if end else content[start:]
+            start = end
             
             if chunk_text.strip():
                 chunks.append({
                     "content": chunk_text,
                     "type": "text_chunk",
-                    "start_line": i + 1,
-                    "end_line": min(i + chunk_size, len(lines)),
+                    "start_line": first_line + 1,
+                    "end_line": min(first_line + chunk_size, total_lines),
                     "metadata": {
                         "file_path": str(file_path),
                         "node_type": "text_chunk",
@@ -237,8 +639,8 @@ class CodeIndexer:
     def _process_doc_file(self, file_path: Path, content: str) -> List[Dict[str, Any]]:
         """Process documentation files."""
         if file_path.suffix == '.md':
-            # Convert markdown to plain text
-            content = markdown.markdown(content)
+            # Strip markup to plain text without rendering HTML
+            content = _MARKDOWN_MARKUP.sub('', content)
         
         return self._simple_chunking(content, file_path)
     
@@ -246,69 +648,126 @@ class CodeIndexer:
         """Process configuration files."""
         return self._simple_chunking(content, file_path)
     
-    def _add_to_collection(self, file_path: Path, chunks: List[Dict[str, Any]]):
-        """Add chunks to ChromaDB collection."""
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{file_path}_{i}"
-            
-            # Generate embedding
-            if self.embedder:
-                embedding = self.embedder.encode(chunk["content"]).tolist()
-            else:
-                embedding = self._simple_embedding(chunk["content"])
-            
-            # Add to collection
-            self.collection.add(
-                embeddings=[embedding],
-                documents=[chunk["content"]],
-                metadatas=[chunk["metadata"]],
-                ids=[chunk_id]
+    def _embed_cached(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, reusing embeddings stored by previous indexing runs."""
+        # Identical chunks (license headers, boilerplate) are embedded once and fanned out
+        unique = list(dict.fromkeys(texts))
+        if self.embedding_cache is None:
+            by_text = dict(zip(unique, self._embed_batch(unique)))
+            return [by_text[text] for text in texts]
+        
+        keys = {text: self.embedding_cache.key(text) for text in unique}
+        found = self.embedding_cache.get_many(list(keys.values()))
+        missing = [text for text in unique if keys[text] not in found]
+        if missing:
+            fresh = self._embed_batch(missing)
+            found.update(self.embedding_cache.put_many(
+                (keys[text], np.asarray(emb, dtype=np.float32)) for text, emb in zip(missing, fresh)
+            ))
+        
+        return [found[keys[text]].tolist() for text in texts]
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a batch of chunks in one model call."""
+        if not self.embedder:
+            return self._hashed_embeddings(texts).tolist()
+        
+        # Length-sorted batches pad each forward pass to similar-sized inputs
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        with _inference_mode():
+            embeddings = self.embedder.encode(
+                [texts[i] for i in order],
+                batch_size=self.encode_batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
             )
+        # Scatter back so rows line up with the caller's ids and metadatas
+        unsorted = np.empty_like(embeddings)
+        unsorted[order] = embeddings
+        return unsorted.tolist()
+    
+    def _add_to_collection(self,
+                           ids: List[str],
+                           embeddings: List[List[float]],
+                           documents: List[str],
+                           metadatas: List[Dict[str, Any]]):
+        """Upsert a batch of chunks into the ChromaDB collection."""
+        try:
+            self.collection.upsert(
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids
+            )
+        except Exception:
+            # Fall back to per-item upserts so a single bad row does not sink the batch
+            for row in zip(ids, embeddings, documents, metadatas):
+                try:
+                    self.collection.upsert(
+                        embeddings=[row[1]],
+                        documents=[row[2]],
+                        metadatas=[row[3]],
+                        ids=[row[0]]
+                    )
+                except Exception as e:
+                    print(f"  ❌ Error adding chunk {row[0]}: {e}")
     
     def _simple_embedding(self, content: str) -> List[float]:
         """Fallback embedding method if sentence_transformers is not available."""
-        import hashlib
-        import struct
-        
-        # Create a simple hash-based embedding
-        hash_obj = hashlib.sha256(content.encode('utf-8'))
-        hash_bytes = hash_obj.digest()
-        
-        # Convert hash to list of floats
-        embedding = []
-        for i in range(0, len(hash_bytes), 4):
-            if i + 4 <= len(hash_bytes):
-                # Convert 4 bytes to float
-                float_val = struct.unpack('f', hash_bytes[i:i+4])[0]
-                embedding.append(float_val)
+        return self._hashed_embeddings([content])[0].tolist()
+    
+    def _hashed_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as L2-normalized counts of hashed character 3-5-grams."""
+        if self._hasher is not None:
+            return self._hasher.transform(texts).toarray().astype(np.float32)
         
-        # Pad or truncate to 384 dimensions
-        while len(embedding) < 384:
-            embedding.append(0.0)
+        # Same features as HashingVectorizer(analyzer='char_wb'), hashed with crc32
+        vectors = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                padded = f" {word} "
+                for n in range(3, 6):
+                    for i in range(max(len(padded) - n + 1, 1)):
+                        bucket = zlib.crc32(padded[i:i + n].encode('utf-8')) % self.embedding_dim
+                        vectors[row, bucket] += 1.0
         
-        return embedding[:384]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
     
-    def search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query string with the same model used for indexing."""
+        return list(self._encode_query(text))
+    
+    @lru_cache(maxsize=1024)
+    def _encode_query(self, text: str) -> Tuple[float, ...]:
+        """Embed a query once; repeated queries are served from the LRU cache."""
+        if self.embedder:
+            with _inference_mode():
+                embedding = self.embedder.encode(text, normalize_embeddings=True)
+            return tuple(embedding.tolist())
+        return tuple(self._simple_embedding(text))
+    
+    def search(self,
+               query: str,
+               n_results: int = 5,
+               include_embeddings: bool = False,
+               query_embedding: Optional[List[float]] = None) -> SearchBatch:
         """Search for relevant code chunks."""
-        query_embedding = self.embedder.encode(query).tolist() if self.embedder else self._simple_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
         
         results = self.collection.query(
             query_embeddings=[query_embedding],
-            n_results=n_results
+            n_results=n_results,
+            include=include
         )
         
-        return [
-            {
-                "content": doc,
-                "metadata": metadata,
-                "distance": distance
-            }
-            for doc, metadata, distance in zip(
-                results["documents"][0],
-                results["metadatas"][0],
-                results["distances"][0]
-            )
-        ]
+        return SearchBatch.from_query_result(results)
     
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the indexed collection."""
@@ -0,0 +1,82 @@
+"""
+Embedding Cache for RAG (Retrieval-Augmented Generation)
+
+This module persists chunk embeddings in SQLite, keyed by a hash of the
+embedding model and chunk text, so unchanged chunks are never re-encoded.
+Embeddings are stored as int8 codes with a per-vector scale.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from cache.quantization import quantize_int8, dequantize_int8
+
+# Keys per SELECT, below SQLite's default bound-parameter limit
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """On-disk map from chunk content hash to int8-quantized embedding."""
+
+    def __init__(self, path: str, signature: str):
+        self.path = path
+        # Identifies the embedding model, so switching models never reuses stale vectors
+        self.signature = signature
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, codes BLOB, scale REAL)"
+        )
+        self.conn.commit()
+
+    def key(self, text: str) -> bytes:
+        """Hash a chunk text together with the model signature."""
+        return hashlib.sha256(f"{self.signature}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return the dequantized cached embeddings for whichever keys are present."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                rows = self.conn.execute(
+                    f"SELECT hash, codes, scale FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, codes, scale in rows:
+                    found[key] = np.frombuffer(codes, dtype=np.int8).astype(np.float32) * np.float32(scale)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]) -> Dict[bytes, np.ndarray]:
+        """Store embeddings as int8, returning the dequantized vectors that were stored."""
+        items = list(items)
+        if not items:
+            return {}
+        codes, scales = quantize_int8(np.stack([emb for _, emb in items]))
+        rows = [
+            (key, codes[i].tobytes(), float(scales[i]))
+            for i, (key, _) in enumerate(items)
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (hash, codes, scale) VALUES (?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+        # Fresh chunks get the same precision as cached ones, so re-runs write identical vectors
+        stored = dequantize_int8(codes, scales)
+        return {key: stored[i] for i, (key, _) in enumerate(items)}
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,76 @@
+"""
+Search Results for RAG (Retrieval-Augmented Generation)
+
+This module holds search results column-wise so rerankers and filters can
+work on contiguous arrays instead of walking per-result dicts.
+"""
+
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class SearchBatch:
+    """Search results stored as a structure of arrays."""
+    ids: np.ndarray
+    contents: List[str]
+    metadatas: List[Dict[str, Any]]
+    distances: np.ndarray
+    file_paths: np.ndarray
+    embeddings: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    @classmethod
+    def from_query_result(cls, results: Dict[str, Any]) -> "SearchBatch":
+        """Build a batch from the first query of a ChromaDB query result."""
+        metadatas = results["metadatas"][0]
+        embeddings = None
+        if results.get("embeddings") is not None:
+            embeddings = np.ascontiguousarray(results["embeddings"][0], dtype=np.float32)
+
+        return cls(
+            ids=np.array(results["ids"][0], dtype=object),
+            contents=list(results["documents"][0]),
+            metadatas=list(metadatas),
+            distances=np.asarray(results["distances"][0], dtype=np.float32),
+            file_paths=np.array([m.get("file_path", "unknown") for m in metadatas], dtype=object),
+            embeddings=embeddings
+        )
+
+    def take(self, indices: Sequence[int]) -> "SearchBatch":
+        """Return a new batch holding only the given rows, in the given order."""
+        idx = np.asarray(indices, dtype=np.intp)
+        return SearchBatch(
+            ids=self.ids[idx],
+            contents=[self.contents[i] for i in idx],
+            metadatas=[self.metadatas[i] for i in idx],
+            distances=self.distances[idx],
+            file_paths=self.file_paths[idx],
+            embeddings=None if self.embeddings is None else self.embeddings[idx]
+        )
+
+    def to_dicts(self, include_embeddings: bool = False) -> List[Dict[str, Any]]:
+        """Convert to the per-result dicts used in API responses."""
+        results = [
+            {
+                "content": content,
+                "metadata": metadata,
+                "distance": distance
+            }
+            for content, metadata, distance in zip(
+                self.contents,
+                self.metadatas,
+                self.distances.tolist()
+            )
+        ]
+
+        # Rows stay numpy arrays; the API serializes them natively with orjson
+        if include_embeddings and self.embeddings is not None:
+            for result, embedding in zip(results, self.embeddings):
+                result["embedding"] = embedding
+
+        return results
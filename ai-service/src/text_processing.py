@@ -0,0 +1,102 @@
+"""
+Text Processing for AI Test Automation
+
+This module holds the string-heavy helpers that run on every generation
+request. It is fully type-annotated and free of service imports so it can be
+compiled ahead of time with mypyc (see ai-service/setup.py).
+"""
+
+import io
+import re
+from typing import Any, Dict, List, Sequence, Set
+
+import numpy as np
+
+# Substrings checked by validate_generated_code, matched together in one pass
+VALIDATION_PATTERNS = ("import", "require", "test(", "it(", "expect(", "assert(", "page.")
+
+# Try to use an Aho-Corasick automaton, fallback to a single regex scan if not available
+try:
+    import ahocorasick
+    _VALIDATION_AUTOMATON: Any = ahocorasick.Automaton()
+    for _pattern in VALIDATION_PATTERNS:
+        _VALIDATION_AUTOMATON.add_word(_pattern, _pattern)
+    _VALIDATION_AUTOMATON.make_automaton()
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    _VALIDATION_AUTOMATON = None
+    AHOCORASICK_AVAILABLE = False
+
+# Lookahead keeps overlapping matches, mirroring independent `in` checks
+_VALIDATION_REGEX = re.compile(
+    "(?=(" + "|".join(re.escape(p) for p in VALIDATION_PATTERNS) + "))"
+)
+
+
+def find_validation_patterns(code: str) -> Set[str]:
+    """Return the validation patterns that occur anywhere in the code."""
+    if _VALIDATION_AUTOMATON is not None:
+        return {pattern for _, pattern in _VALIDATION_AUTOMATON.iter(code)}
+    return set(_VALIDATION_REGEX.findall(code))
+
+
+def format_context(file_paths: Sequence[str],
+                   metadatas: Sequence[Dict[str, Any]],
+                   contents: Sequence[str],
+                   max_chars: int) -> str:
+    """Format context chunks for an LLM prompt, within a character budget."""
+    if len(contents) == 0:
+        return "No relevant context found."
+
+    buf = io.StringIO()
+    for i in range(len(contents)):
+        file_path = file_paths[i]
+        node_type = (metadatas[i] or {}).get("node_type", "unknown")
+
+        header = f"\n--- Context {i + 1} (from {file_path}, type: {node_type}) ---\n"
+        if i > 0:
+            header = "\n" + header
+
+        # Stop once the budget is spent, truncating the chunk that crosses it
+        remaining = max_chars - buf.tell() - len(header)
+        if remaining <= 0:
+            break
+        buf.write(header)
+        buf.write(contents[i][:remaining])
+        buf.write("\n")
+
+    return buf.getvalue()
+
+
+def validate_generated_code(code: str) -> Dict[str, Any]:
+    """Basic validation of generated code."""
+    issues: List[str] = []
+    warnings: List[str] = []
+
+    # Check for basic TypeScript/Playwright patterns
+    found = find_validation_patterns(code)
+    if "import" not in found and "require" not in found:
+        warnings.append("No imports found - may need Playwright imports")
+
+    if "test(" not in found and "it(" not in found:
+        issues.append("No test function found")
+
+    if "expect(" not in found and "assert(" not in found:
+        warnings.append("No assertions found")
+
+    if "page." not in found:
+        warnings.append("No page interactions found")
+
+    # Check for common syntax issues, counting every byte class in one pass
+    byte_counts = np.bincount(np.frombuffer(code.encode('utf-8'), dtype=np.uint8), minlength=256)
+    if byte_counts[ord("{")] != byte_counts[ord("}")]:
+        issues.append("Mismatched braces")
+
+    if byte_counts[ord("(")] != byte_counts[ord(")")]:
+        issues.append("Mismatched parentheses")
+
+    return {
+        "valid": not issues,
+        "issues": issues,
+        "warnings": warnings
+    }
@@ -5,6 +5,7 @@ Test Generation Script
 This script generates tests using the AI service.
 """
 
+import asyncio
 import sys
 import argparse
 from pathlib import Path
@@ -15,6 +16,17 @@ sys.path.insert(0, str(Path(__file__).parent / "ai-service" / "src"))
 from ai_service import AIService
 
 
+async def _run_generation(ai_service: AIService, requirements: str, context_query: str):
+    """Run the async generation and release the LLM client afterwards."""
+    try:
+        return await ai_service.generate_test(
+            requirements=requirements,
+            context_query=context_query
+        )
+    finally:
+        await ai_service.aclose()
+
+
 def main():
     """Main function for test generation."""
     parser = argparse.ArgumentParser(description="Generate tests using AI")
@@ -33,14 +45,11 @@ def main():
         codebase_path=".",
         db_path="./chroma_db",
         ollama_url="http://localhost:11434",
-        ollama_model="mistral"
+        ollama_model="mistral:7b-instruct-q4_K_M"
     )
     
     # Generate test
-    result = ai_service.generate_test(
-        requirements=args.requirements,
-        context_query=args.context
-    )
+    result = asyncio.run(_run_generation(ai_service, args.requirements, args.context))
     
     if not result["success"]:
         print(f"❌ Failed to generate test: {result.get('error', 'Unknown error')}")
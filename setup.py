@@ -5,6 +5,7 @@ Setup script for AI Test Automation Framework
 This script initializes the AI service and indexes the codebase.
 """
 
+import asyncio
 import sys
 import os
 from pathlib import Path
@@ -15,6 +16,14 @@ sys.path.insert(0, str(Path(__file__).parent / "ai-service" / "src"))
 from ai_service import AIService
 
 
+async def _run_setup(ai_service: AIService):
+    """Run the async setup and release the LLM client afterwards."""
+    try:
+        return await ai_service.setup()
+    finally:
+        await ai_service.aclose()
+
+
 def main():
     """Main setup function."""
     print("🤖 Setting up AI Test Automation Framework...")
@@ -27,14 +36,14 @@ def main():
         codebase_path=str(codebase_path),
         db_path="./chroma_db",
         ollama_url="http://localhost:11434",
-        ollama_model="mistral"
+        ollama_model="mistral:7b-instruct-q4_K_M"
     )
     
     print(f"📁 Codebase path: {codebase_path}")
     print("🔍 Setting up AI service...")
     
     # Setup the service
-    result = ai_service.setup()
+    result = asyncio.run(_run_setup(ai_service))
     
     # Display results
     print("\n📊 Setup Results:")